@@ -15,6 +15,7 @@
 from __future__ import with_statement
 import os, httplib, urlparse, base64, threading
 from XQuery import XQuery
+from Exporter import Exporter
 
 _query_tmpl = '''
 <query xmlns="http://exist.sourceforge.net/NS/exist"%s>
@@ -72,6 +73,7 @@ class ExistDB(object):
         self.username = auth.split(':', 1)[0]
         self.password = auth[len(self.username) + 1:]
         self.lock     = threading.Lock()
+        self.netloc   = netloc
         self.conn     = httplib.HTTP(netloc)
         self.path     = ''
         if uri.path:
@@ -80,15 +82,19 @@ class ExistDB(object):
             self.path += '/' + collection.strip('/')
         self.query_cls = query_cls
 
-    def _authenticate(self):
+    def _get_auth_header(self):
         if not self.username:
-            return
+            return None
         if self.password:
             auth = self.username + ':' + self.password
         else:
             auth = self.username
-        auth = base64.encodestring(auth).strip()
-        self.conn.putheader('Authorization', 'Basic ' + auth)
+        return 'Basic ' + base64.encodestring(auth).strip()
+
+    def _authenticate(self):
+        auth = self._get_auth_header()
+        if auth is not None:
+            self.conn.putheader('Authorization', auth)
 
     def store(self, doc, xml):
         """
@@ -256,3 +262,23 @@ class ExistDB(object):
         """
         thequery = open(filename, 'r').read()
         return self.query(thequery, **kwargs)
+
+    def export(self, directory, collection = '', **kwargs):
+        """
+        Downloads all documents in the given collection, including all
+        subcollections, into the given local directory. Documents are
+        fetched concurrently; the given kwargs are passed to the
+        constructor of the Exporter.
+
+        @type  directory: string
+        @param directory: The local directory to write the documents to.
+        @type  collection: string
+        @param collection: A collection name, relative to this database.
+        @type  kwargs: dict
+        @param kwargs: See Exporter.__init__().
+        @rtype:  Exporter
+        @return: The Exporter, holding the statistics of the export.
+        """
+        exporter = Exporter(self, **kwargs)
+        exporter.export(directory, collection)
+        return exporter
@@ -0,0 +1,347 @@
+# Copyright (C) 2010 Samuel Abels.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2, as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+from __future__ import with_statement
+import os, sys, re, time, calendar, gzip, socket, httplib, urllib, threading
+from Queue import Queue
+
+_timestamp_re = re.compile(r'^(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)'
+                         + r'(?:\.\d+)?(Z|[+-]\d\d:?\d\d)?$')
+
+def _parse_timestamp(string):
+    """
+    Converts an ISO 8601 timestamp, as used by eXist in collection listings,
+    into seconds since the epoch. Returns None if the string can not be
+    parsed.
+    """
+    match = _timestamp_re.match(string or '')
+    if match is None:
+        return None
+    fields = [int(f) for f in match.groups()[:6]]
+    stamp  = calendar.timegm(fields + [0, 0, 0])
+    tz     = match.group(7)
+    if tz and tz != 'Z':
+        offset = int(tz[1:3]) * 3600 + int(tz[-2:]) * 60
+        if tz[0] == '+':
+            stamp -= offset
+        else:
+            stamp += offset
+    return stamp
+
+def _encode_filename(name):
+    """
+    Encodes the given unicode file name using the filesystem encoding.
+    Falls back to UTF-8 if the filesystem encoding can not represent it.
+    """
+    try:
+        return name.encode(sys.getfilesystemencoding() or 'utf-8')
+    except UnicodeError:
+        return name.encode('utf-8')
+
+class Exporter(object):
+    """
+    Mirrors a collection, including all subcollections, to a local
+    directory. You normally don't want to create an Exporter instance
+    directly, try using ExistDB.export() instead.
+
+    Documents are downloaded by a number of worker threads, each of which
+    keeps a persistent HTTP connection to the server. Every document is
+    streamed to disk in chunks, so a collection is never held in memory
+    as a whole.
+    """
+    BLOCKSIZE = 65536
+
+    def __init__(self,
+                 db,
+                 threads        = 4,
+                 compress       = False,
+                 skip_unchanged = True,
+                 callback       = None,
+                 timeout        = 60):
+        """
+        Use ExistDB.export() instead of creating an exporter directly.
+
+        @type  db: ExistDB
+        @param db: The database to export from.
+        @type  threads: int
+        @param threads: The number of concurrent downloads.
+        @type  compress: bool
+        @param compress: Whether to gzip the files. If True, '.gz' is
+            appended to each filename.
+        @type  skip_unchanged: bool
+        @param skip_unchanged: Whether to skip documents for which a local
+            copy with the same modification time already exists.
+        @type  callback: function
+        @param callback: Called as callback(exporter, path, status) after
+            each document, where status is one of 'done', 'skipped' or
+            'failed'. Calls are serialized, and exceptions raised by the
+            callback are ignored.
+        @type  timeout: float
+        @param timeout: The socket timeout in seconds. A document for
+            which the server stalls longer than this is marked as failed.
+        """
+        self.db             = db
+        self.threads        = max(1, int(threads))
+        self.compress       = compress
+        self.skip_unchanged = skip_unchanged
+        self.callback       = callback
+        self.timeout        = timeout
+        self.lock           = threading.Lock()
+        self.idle           = threading.Condition(self.lock)
+        self._reset()
+
+    def _reset(self):
+        self.documents = 0
+        self.skipped   = 0
+        self.bytes     = 0
+        self.failed    = []
+        self.started   = None
+        self.finished  = None
+        self._pending  = 0
+        self._stopped  = False
+
+    def _record(self, path, status, size = 0, error = None):
+        with self.lock:
+            if status == 'done':
+                self.documents += 1
+                self.bytes     += size
+            elif status == 'skipped':
+                self.skipped += 1
+            else:
+                self.failed.append((path, error))
+            if self.callback is None:
+                return
+            try:
+                self.callback(self, path, status)
+            except Exception:
+                # A broken progress reporter (such as a closed pipe) must
+                # not affect the export.
+                pass
+
+    def _enqueue(self, queue, job):
+        with self.lock:
+            self._pending += 1
+        queue.put(job)
+
+    def _task_done(self):
+        with self.lock:
+            self._pending -= 1
+            if not self._pending:
+                self.idle.notifyAll()
+
+    def _request(self, conn, path):
+        headers = {}
+        auth    = self.db._get_auth_header()
+        if auth is not None:
+            headers['Authorization'] = auth
+        url = urllib.quote(path)
+
+        # The server may have closed the persistent connection since the
+        # last request, so retry once on a fresh one.
+        try:
+            conn.request('GET', url, headers = headers)
+            response = conn.getresponse()
+        except (httplib.HTTPException, socket.error):
+            conn.close()
+            conn.request('GET', url, headers = headers)
+            response = conn.getresponse()
+
+        if response.status != 200:
+            response.read()
+            raise self.db.Error('Error %d: %s' % (response.status,
+                                                  response.reason))
+        return response
+
+    def _list(self, conn, path):
+        from lxml import etree
+
+        response = self._request(conn, path)
+        tree     = etree.fromstring(response.read())
+        ns       = '{' + self.db.RESULT_NS + '}'
+        root     = tree.find(ns + 'collection')
+        if root is None:
+            raise self.db.Error('not a collection: ' + path)
+
+        # lxml returns unicode for non-ASCII names, so use UTF-8 encoded
+        # strings throughout to be able to quote them in URLs.
+        collections = [c.get('name').encode('utf-8')
+                       for c in root.findall(ns + 'collection')]
+        resources   = [(r.get('name').encode('utf-8'),
+                        _parse_timestamp(r.get('last-modified')))
+                       for r in root.findall(ns + 'resource')]
+        return collections, resources
+
+    def _download(self, conn, path, filename, mtime):
+        if self.compress:
+            filename += '.gz'
+
+        # Remove leftovers of an interrupted run.
+        tmpname = filename + '.part'
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+
+        if self.skip_unchanged \
+          and mtime is not None \
+          and os.path.isfile(filename) \
+          and int(os.path.getmtime(filename)) == mtime:
+            return None
+
+        # Write to a temporary file first, such that an interrupted
+        # download never leaves a truncated document behind.
+        response = self._request(conn, path)
+        outfile  = open(tmpname, 'wb')
+        size     = 0
+        try:
+            try:
+                # Store the final name in the gzip header, not the
+                # temporary one.
+                if self.compress:
+                    writer = gzip.GzipFile(filename = filename[:-3],
+                                           mode     = 'wb',
+                                           fileobj  = outfile)
+                else:
+                    writer = outfile
+                while True:
+                    data = response.read(self.BLOCKSIZE)
+                    if not data:
+                        break
+                    writer.write(data)
+                    size += len(data)
+                writer.close()
+            finally:
+                outfile.close()
+        except:
+            os.remove(tmpname)
+            raise
+
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmpname, filename)
+        if mtime is not None:
+            os.utime(filename, (mtime, mtime))
+        return size
+
+    def _process(self, conn, queue, directory, root, kind, path, mtime):
+        names    = [_encode_filename(n.decode('utf-8'))
+                    for n in path.split('/')[1:]]
+        filename = os.path.join(directory, *names)
+        if kind == 'collection':
+            collections, resources = self._list(conn, root + path)
+            if not os.path.isdir(filename):
+                os.makedirs(filename)
+            for name in collections:
+                self._enqueue(queue, ('collection', path + '/' + name, None))
+            for name, mtime in resources:
+                self._enqueue(queue, ('resource', path + '/' + name, mtime))
+            return
+
+        size = self._download(conn, root + path, filename, mtime)
+        if size is None:
+            self._record(path, 'skipped')
+        else:
+            self._record(path, 'done', size)
+
+    def _worker(self, queue, directory, root):
+        conn = httplib.HTTPConnection(self.db.netloc, timeout = self.timeout)
+        while True:
+            job = queue.get()
+            if job is None:
+                break
+            try:
+                if not self._stopped:
+                    self._process(conn, queue, directory, root, *job)
+            except Exception, e:
+                # Keep going; the connection is reopened on the next request.
+                conn.close()
+                self._record(job[1], 'failed', error = e)
+            finally:
+                self._task_done()
+        conn.close()
+
+    def export(self, directory, collection = ''):
+        """
+        Downloads all documents in the given collection and its
+        subcollections into the given directory. Documents that can not
+        be downloaded are listed in the 'failed' attribute afterwards.
+
+        Documents are first written to a temporary file with a '.part'
+        suffix. Such files are removed when the document is exported
+        again, but not if the document was deleted on the server since.
+
+        @type  directory: string
+        @param directory: The local directory to write the documents to.
+        @type  collection: string
+        @param collection: A collection name, relative to the database.
+        """
+        root = self.db.path
+        if collection:
+            root += '/' + collection.strip('/')
+        if isinstance(root, unicode):
+            root = root.encode('utf-8')
+        if isinstance(directory, unicode):
+            directory = _encode_filename(directory)
+
+        self._reset()
+        self.started = time.time()
+        queue        = Queue()
+        self._enqueue(queue, ('collection', '', None))
+        workers = []
+        for n in range(self.threads):
+            thread = threading.Thread(target = self._worker,
+                                      args   = (queue, directory, root))
+            thread.setDaemon(True)
+            thread.start()
+            workers.append(thread)
+
+        # Collections enqueue their children before they are marked done,
+        # so nothing is pending once the whole tree has been processed.
+        # Wait with a timeout, such that a KeyboardInterrupt gets through.
+        try:
+            with self.lock:
+                while self._pending:
+                    self.idle.wait(.5)
+        finally:
+            # If interrupted, the workers drop the remaining jobs.
+            self._stopped = True
+            for thread in workers:
+                queue.put(None)
+            self.finished = time.time()
+        for thread in workers:
+            while thread.isAlive():
+                thread.join(.5)
+
+    def elapsed(self):
+        """
+        Returns the time that the last export took, or has taken so far.
+
+        @rtype:  float
+        @return: The elapsed time in seconds.
+        """
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def throughput(self):
+        """
+        Returns the average download rate of the last export. Only
+        documents that were actually downloaded are counted, using their
+        uncompressed size.
+
+        @rtype:  float
+        @return: The throughput in bytes per second.
+        """
+        elapsed = self.elapsed()
+        if not elapsed:
+            return 0.0
+        return self.bytes / elapsed
@@ -0,0 +1,194 @@
+import sys, unittest, re, os.path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+import time, gzip, shutil, tempfile, threading, urllib
+import BaseHTTPServer, SocketServer
+from pyexist          import ExistDB, Exporter
+from pyexist.Exporter import _parse_timestamp
+
+_result_tmpl = '''<exist:result xmlns:exist="%s">
+  <exist:collection name="/db%s">%s</exist:collection>
+</exist:result>'''
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves the collections and documents of the server that it belongs
+    to, like the REST interface of eXist does.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = urllib.unquote(self.path)
+        if path in self.server.stalled:
+            time.sleep(2)
+        if path in self.server.collections:
+            collections, resources = self.server.collections[path]
+            items = ['<exist:collection name="%s"/>' % c for c in collections]
+            for name, mtime in resources:
+                items.append('<exist:resource name="%s" last-modified="%s"/>'
+                             % (name, mtime))
+            body = _result_tmpl % (ExistDB.RESULT_NS, path, ''.join(items))
+        elif path in self.server.documents:
+            body = self.server.documents[path]
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class ExporterTest(unittest.TestCase):
+    CORRELATE = Exporter
+
+    def setUp(self):
+        self.server = StubServer(('127.0.0.1', 0), StubHandler)
+        self.server.stalled     = []
+        self.server.collections = {
+            '/db/coll':     (['sub'],
+                             [('a.xml',         '2010-01-22T14:30:12.345+01:00'),
+                              ('\xc3\xa9.xml',  '2010-01-22T13:30:12Z')]),
+            '/db/coll/sub': ([], [('big.xml', '2011-05-05T00:00:00.000Z')])
+        }
+        self.server.documents = {
+            '/db/coll/a.xml':        '<a/>',
+            '/db/coll/\xc3\xa9.xml': '<e/>',
+            '/db/coll/sub/big.xml':  '<big>' + 'x' * 200000 + '</big>'
+        }
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.db  = ExistDB('127.0.0.1:%d/db' % self.server.server_port)
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def testParseTimestamp(self):
+        expected = 1264167012
+        self.assertEqual(_parse_timestamp('2010-01-22T13:30:12Z'), expected)
+        self.assertEqual(_parse_timestamp('2010-01-22T15:30:12+02:00'),
+                         expected)
+        self.assertEqual(_parse_timestamp('2010-01-22T15:30:12+0200'),
+                         expected)
+        self.assertEqual(_parse_timestamp('2010-01-22T10:30:12-03:00'),
+                         expected)
+        self.assertEqual(_parse_timestamp('2010-01-22T13:30:12.345Z'),
+                         expected)
+        self.assertEqual(_parse_timestamp('2010-01-22T13:30:12'), expected)
+        self.assertEqual(_parse_timestamp('Jan 22, 2010 1:30:12 PM'), None)
+        self.assertEqual(_parse_timestamp('garbage'), None)
+        self.assertEqual(_parse_timestamp(''), None)
+        self.assertEqual(_parse_timestamp(None), None)
+
+    def testConstructor(self):
+        exporter = Exporter(self.db)
+        self.assertEqual(exporter.threads, 4)
+        self.assertEqual(exporter.compress, False)
+        self.assertEqual(exporter.skip_unchanged, True)
+        self.assertEqual(exporter.documents, 0)
+        self.assertEqual(exporter.failed, [])
+        self.assertEqual(Exporter(self.db, threads = 0).threads, 1)
+
+    def testExport(self):
+        exporter = Exporter(self.db)
+        exporter.export(self.dir, 'coll')
+        self.assertEqual(exporter.failed, [])
+        self.assertEqual(exporter.documents, 3)
+        self.assertEqual(exporter.skipped, 0)
+        for path, content in self.server.documents.iteritems():
+            filename = os.path.join(self.dir, path[len('/db/coll/'):])
+            self.assertEqual(open(filename, 'rb').read(), content)
+        filename = os.path.join(self.dir, 'a.xml')
+        self.assertEqual(os.path.getmtime(filename), 1264167012)
+        self.assertEqual(exporter.bytes,
+                         sum(len(d) for d in self.server.documents.values()))
+        self.assertEqual(os.listdir(self.dir + '/sub'), ['big.xml'])
+
+        # Unchanged documents are skipped, unless forced.
+        exporter.export(self.dir, 'coll')
+        self.assertEqual(exporter.documents, 0)
+        self.assertEqual(exporter.skipped, 3)
+        exporter = Exporter(self.db, skip_unchanged = False)
+        exporter.export(self.dir, 'coll')
+        self.assertEqual(exporter.documents, 3)
+        self.assertEqual(exporter.skipped, 0)
+
+        # Changed documents are downloaded again, and stale temporary
+        # files are removed.
+        open(os.path.join(self.dir, 'a.xml.part'), 'w').close()
+        os.utime(filename, (0, 0))
+        exporter = Exporter(self.db)
+        exporter.export(self.dir, 'coll')
+        self.assertEqual(exporter.documents, 1)
+        self.assertEqual(exporter.skipped, 2)
+        self.assert_(not os.path.exists(filename + '.part'))
+
+    def testExportCompress(self):
+        exporter = Exporter(self.db, compress = True)
+        exporter.export(self.dir, 'coll')
+        self.assertEqual(exporter.failed, [])
+        filename = os.path.join(self.dir, 'sub', 'big.xml.gz')
+        content  = self.server.documents['/db/coll/sub/big.xml']
+        self.assertEqual(gzip.open(filename).read(), content)
+
+        # The gzip header holds the name of the uncompressed file.
+        header = open(filename, 'rb').read(100)
+        self.assertEqual(header[10:].split('\0')[0], 'big.xml')
+
+        exporter.export(self.dir, 'coll')
+        self.assertEqual(exporter.skipped, 3)
+
+    def testExportFailure(self):
+        resources = self.server.collections['/db/coll/sub'][1]
+        resources.append(('missing.xml', '2011-05-05T00:00:00Z'))
+        self.server.collections['/db/coll'][0].append('unlisted')
+
+        def callback(exporter, path, status):
+            raise IOError('broken pipe')
+
+        exporter = Exporter(self.db, callback = callback)
+        exporter.export(self.dir, 'coll')
+        self.assertEqual(exporter.documents, 3)
+        failed = sorted(path for path, error in exporter.failed)
+        self.assertEqual(failed, ['/sub/missing.xml', '/unlisted'])
+        self.assert_(not os.path.exists(self.dir + '/sub/missing.xml'))
+        self.assert_(not os.path.exists(self.dir + '/sub/missing.xml.part'))
+
+    def testExportTimeout(self):
+        self.server.stalled.append('/db/coll/a.xml')
+        exporter = Exporter(self.db, timeout = .2)
+        exporter.export(self.dir, 'coll')
+        self.assertEqual(exporter.documents, 2)
+        self.assertEqual([path for path, error in exporter.failed],
+                         ['/a.xml'])
+
+    def testElapsed(self):
+        exporter = Exporter(self.db)
+        self.assertEqual(exporter.elapsed(), 0.0)
+        exporter.export(self.dir, 'coll')
+        elapsed = exporter.elapsed()
+        self.assert_(elapsed > 0)
+        self.assertEqual(exporter.elapsed(), elapsed)
+
+    def testThroughput(self):
+        exporter = Exporter(self.db)
+        self.assertEqual(exporter.throughput(), 0.0)
+        exporter.export(self.dir, 'coll')
+        self.assertEqual(exporter.throughput(),
+                         exporter.bytes / exporter.elapsed())
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(ExporterTest)
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity = 2).run(suite())